@@ -1,9 +1,10 @@
 import os
+import re
+import csv
 import glob
 import subprocess
 import itertools
 import numpy as np
-import csv
 
 # -------------------------------------------------------------------
 # 1) CAMINHO ABSOLUTO DA SUA BIBLIOTECA .lib
@@ -29,10 +30,14 @@ os.makedirs(WORKDIR, exist_ok=True)
 Vbias_vals = np.arange(1.0, 5.0 + 0.5, 0.5)
 
 # -------------------------------------------------------------------
-# 4) TEMPLATE DE NETLIST (AJUSTADO PARA O .asc)
+# 4) NETLIST (AJUSTADO PARA O .asc)
 # -------------------------------------------------------------------
-NETLIST_TEMPLATE = f"""* Netlist adaptada do 'CMOS class AB Output STAGES_FINAL.asc'
-.param Vbias={{Vbias}}
+# Toda a varredura de Vbias vai num único netlist com .step: o LTspice
+# abre e lê a biblioteca de modelos uma vez só, em vez de uma vez por ponto
+VBIAS_LIST = " ".join(f"{Vb:g}" for Vb in Vbias_vals)
+
+NETLIST = f"""* Netlist adaptada do 'CMOS class AB Output STAGES_FINAL.asc'
+.step param Vbias list {VBIAS_LIST}
 
 * Modelos de fallback
 .model nmos NMOS
@@ -53,11 +58,15 @@ Vdd   Vdd  0      DC 5
 V2    in   0      AC 1
 Vdd1  out  0      DC 0  * Sonda de corrente para medição (como no .asc)
 
+* Só os vetores usados pelas medições vão para o .raw
+.save V(out) V(in) I(Vdd)
+
 * Análises
 .op
-.ac dec 1000 1e8 1e9 * Range do .asc 
+.ac dec 50 1e8 1e9 * Range do .asc (50 pts/déc bastam para o .measure MAX)
 
 * Medições no log (Medições do script original)
+.measure op IDD  FIND I(Vdd)
 .measure ac GMAX MAX mag(v(out)/v(in))
 .measure ac FC   WHEN mag(v(out)/v(in))=GMAX/sqrt(2)
 
@@ -65,59 +74,91 @@ Vdd1  out  0      DC 0  * Sonda de corrente para medição (como no .asc)
 """
 
 # -------------------------------------------------------------------
-# 5) VARREDURA E COLETA (AJUSTADO PARA VARRER SÓ Vbias)
+# 5) PARSE DO LOG (REGEX COMPILADAS UMA VEZ, NA IMPORTAÇÃO)
 # -------------------------------------------------------------------
-results = []
-# Loop alterado para varrer apenas Vb
-for Vb in Vbias_vals:
-    tag      = f"V{int(Vb*1e3)}mV"
-    cir_path = os.path.join(WORKDIR, f"amp_{tag}.cir")
-    log_path = os.path.join(WORKDIR, f"amp_{tag}.log")
+# Com .step, cada medição vira uma tabela no fim do log:
+#   Measurement: gmax
+#     step	MAX(mag(v(out)/v(in)))	FROM	TO
+#        1	(30.5055dB,180°)	1e+08	1e+09
+MEAS_BLOCK_RE = re.compile(
+    r'^Measurement:[ \t]*(?P<key>gmax|fc|idd)[ \t]*\n'  # cabeçalho
+    r'[ \t]+step\b.*\n'                                # nomes das colunas
+    r'(?P<rows>(?:[ \t]+\d+[ \t].*(?:\n|$))*)',         # uma linha por passo
+    re.I | re.M)
+STEP_ROW_RE = re.compile(r'^[ \t]+(\d+)[ \t]+\(?([-+]?inf|[-+0-9.eE]+)', re.I | re.M)
+
+# As tabelas do .step ficam no fim do log: lê de trás para frente, em
+# blocos, até encontrar as três (como um `tail`)
+LOG_TAIL_CHUNK = 8192
+LOG_TAIL_KEYS = (b"measurement: gmax", b"measurement: fc", b"measurement: idd")
+
+def read_log_tail(log_path):
+    with open(log_path, "rb") as lf:
+        pos = lf.seek(0, os.SEEK_END)
+        data = b""
+        while pos > 0:
+            n = min(LOG_TAIL_CHUNK, pos)
+            pos -= n
+            lf.seek(pos)
+            data = lf.read(n) + data
+            data_lower = data.lower()
+            if all(k in data_lower for k in LOG_TAIL_KEYS):
+                break
+    # Se alguma tabela faltar, data já é o log inteiro
+    return data.decode("utf-8", errors="ignore")
+
+def parse_log(log_path, n_steps):
+    txt = read_log_tail(log_path)
+
+    # finditer sobre o texto todo: o laço linha a linha fica dentro do
+    # motor de regex (em C), não em Python
+    vals = {key: np.full(n_steps, np.nan) for key in ("gmax", "fc", "idd")}
+    for block in MEAS_BLOCK_RE.finditer(txt):
+        col = vals[block.group("key").lower()]
+        for m in STEP_ROW_RE.finditer(block.group("rows")):
+            step = int(m.group(1))
+            if 1 <= step <= n_steps:
+                col[step - 1] = float(m.group(2))
+
+    # Mede a corrente da fonte Vdd (que agora é 5V)
+    return vals["gmax"], vals["fc"], np.abs(vals["idd"])
+
+if __name__ == "__main__":
+    # -------------------------------------------------------------------
+    # 6) VARREDURA E COLETA (UMA ÚNICA CHAMADA DO LTspice)
+    # -------------------------------------------------------------------
+    cir_path = os.path.join(WORKDIR, "amp_Vbias_step.cir")
+    log_path = os.path.join(WORKDIR, "amp_Vbias_step.log")
 
     # Gera netlist
     with open(cir_path, "w") as f:
-        # Format alterado para passar apenas Vbias
-        f.write(NETLIST_TEMPLATE.format(Vbias=Vb))
+        f.write(NETLIST)
 
-    # Roda LTspice em batch/ASCII
-    cmd = [LTSPICE_EXE, "-ascii", "-b", cir_path, "-log", log_path]
+    # Roda LTspice em batch (.raw binário: só o .log é lido)
+    cmd = [LTSPICE_EXE, "-b", cir_path, "-log", log_path]
     print("⏳ Executando:", " ".join(cmd))
     subprocess.run(cmd, check=True)
 
-    # Parse das medições no log (Lógica mantida)
-    Gmax = np.nan
-    fc   = np.nan
-    Idd  = np.nan
-    with open(log_path, "r") as lf:
-        for line in lf:
-            if line.startswith("GMAX"):
-                # Ex.: GMAX: MAX mag(v(out)/v(in)) = 24.3 dB at 1.00e+06 Hz
-                parts = line.split("=")[1].split()
-                Gmax  = float(parts[0])
-            elif line.startswith("FC"):
-                # Ex.: FC: WHEN ... = 3.16e+05
-                parts = line.split("=")[1].split()
-                fc    = float(parts[0])
-            elif "I(Vdd)" in line:
-                try:
-                    # Mede a corrente da fonte Vdd (que agora é 5V)
-                    Idd = abs(float(line.split()[1]))
-                except:
-                    pass
+    # Parse das medições no log (uma linha por passo do .step)
+    Gmax, fc, Idd = parse_log(log_path, len(Vbias_vals))
 
+    # Resultado alterado para refletir a nova varredura (uma linha por Vbias)
+    results = np.empty((len(Vbias_vals), 4), dtype=np.float64)
+    results[:, 0] = Vbias_vals
+    results[:, 1] = Gmax
+    results[:, 2] = fc
     # Cálculo de potência ajustado para Vdd=5V 
-    Power = 5.0 * Idd
-    # Resultado alterado para refletir a nova varredura
-    results.append((Vb, Gmax, fc, Power))
-
-# -------------------------------------------------------------------
-# 6) SALVA NO CSV (AJUSTADO PARA NOVOS DADOS)
-# -------------------------------------------------------------------
-csv_path = os.path.join(WORKDIR, "simulation_results.csv")
-with open(csv_path, "w", newline="") as f:
-    w = csv.writer(f)
-    # Colunas do CSV alteradas
-    w.writerow(["Vbias (V)", "Gain (dB)", "fc (Hz)", "Power (W)"])
-    w.writerows(results)
-
-print("✅ Pronto! Veja:", csv_path)
\ No newline at end of file
+    results[:, 3] = 5.0 * Idd
+
+    # -------------------------------------------------------------------
+    # 7) SALVA NO CSV (AJUSTADO PARA NOVOS DADOS)
+    # -------------------------------------------------------------------
+    csv_path = os.path.join(WORKDIR, "simulation_results.csv")
+    # (tolist() devolve floats do Python: o CSV mantém o formato "1.0")
+    with open(csv_path, "w", newline="") as f:
+        w = csv.writer(f)
+        # Colunas do CSV alteradas
+        w.writerow(["Vbias (V)", "Gain (dB)", "fc (Hz)", "Power (W)"])
+        w.writerows(results.tolist())
+
+    print("✅ Pronto! Veja:", csv_path)
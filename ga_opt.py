@@ -1,22 +1,46 @@
 # ga_opt.py
 # GA robusto adaptado para otimizar Wn, Wp, Vbias de um estágio Classe AB
-# Requisitos: Python 3.9+, deap, numpy
+# Requisitos: Python 3.9+, deap, numpy (opcional: pyahocorasick; psutil
+# para afinidade de CPU no Windows; PySpice + libngspice para USE_NGSPICE)
 # Vars de ambiente (opcional):
 #  - LTSPICE_EXE: caminho do executável (ex: C:\Program Files\LTspice\XVIIx64.exe)
 #  - LIB_PATH: caminho do C5_models_SPICE.txt
-
-import os, sys, math, time, tempfile, shutil, subprocess, re, json, random
+#  - GA_WORKERS: nº de processos simulando em paralelo (padrão: os.cpu_count()//2)
+#  - GA_TMPDIR: onde criar os arquivos temporários de simulação
+#    (padrão: C:\Temp\ga_amp no Windows, /dev/shm/ga_amp no Linux)
+#  - GA_CACHE_DIR: onde salvar o cache de fitness entre execuções (padrão: ga_runs)
+#  - USE_NGSPICE=1: simula com o libngspice (PySpice) em vez do LTspice
+#  - GA_PIN_CPUS=0: não fixa cada worker num conjunto próprio de núcleos
+
+import os, sys, math, time, tempfile, shutil, subprocess, re, json, random, hashlib, sqlite3
 from pathlib import Path
+from multiprocessing import Pool, Value
+from functools import partial
+from collections import deque
 import numpy as np
 
 from deap import base, creator, tools
 
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
 # =========================
 # Configs de ambiente
 # =========================
 LTSPICE_EXE = os.environ.get("LTSPICE_EXE", r"C:\Program Files\ADI\LTspice\LTspice.exe")
 LIB_PATH = os.environ.get("LIB_PATH", r"C:\Users\holam\OneDrive - Sociedade Visconde de São Leopoldo\Área de Trabalho\otimizacao-cmos-unisantos\C5_models_SPICE.txt")
 
+# Caminho absoluto resolvido uma vez: no POSIX, o subprocess só usa o
+# posix_spawn (mais barato que fork+exec) quando o executável tem diretório
+LTSPICE_EXE = shutil.which(LTSPICE_EXE) or LTSPICE_EXE
+
 if not Path(LTSPICE_EXE).exists():
     print(f"Atenção: LTspice.exe NÃO ENCONTRADO EM: {LTSPICE_EXE}")
     
@@ -24,9 +48,64 @@ if not Path(LIB_PATH).exists():
     print(f"Atenção: Biblioteca de modelos NÃO ENCONTRADA EM: {LIB_PATH}")
 
 IS_WINDOWS = os.name == "nt"
-LTSPICE_ARGS = ["-run", "-b", "-ascii"]
+# Sem -ascii: só o .log é lido, e o .raw binário é bem menor
+LTSPICE_ARGS = ["-Run", "-b"]
 TIMEOUT_S = 25
 
+# Pontos/década do .ac: o custo da simulação cresce linearmente com eles e
+# o .meas MAX/WHEN pouco muda numa resposta suave. As gerações iniciais
+# usam a varredura grossa; as AC_FINE_GENS últimas (e o resultado final)
+# são avaliadas com a fina.
+AC_PTS_COARSE = 20
+AC_PTS_FINE = 100
+AC_FINE_GENS = 3
+# Metade dos núcleos por padrão: cada LTspice também usa mais de uma thread
+N_WORKERS = int(os.environ.get("GA_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+# Máximo de indivíduos por lote .step: lotes menores (mais lotes que
+# workers) deixam o pool equilibrar a carga quando uma simulação demora
+BATCH_MAX = 4
+
+# Temporários fora da pasta do usuário (sincronizada pelo OneDrive): cada
+# .cir/.log/.raw escrito lá dispara upload. No Linux, /dev/shm é RAM.
+if IS_WINDOWS:
+    _DEFAULT_TMPDIR = r"C:\Temp\ga_amp"
+elif Path("/dev/shm").is_dir():
+    _DEFAULT_TMPDIR = "/dev/shm/ga_amp"
+else:
+    _DEFAULT_TMPDIR = os.path.join(tempfile.gettempdir(), "ga_amp")
+TMPDIR = Path(os.environ.get("GA_TMPDIR", _DEFAULT_TMPDIR))
+
+# Ambiente enxuto para o LTspice, montado uma vez: só o que o executável
+# (ou o wine, fora do Windows) precisa, com os temporários em TMPDIR
+_ENV_KEYS = ("PATH", "SYSTEMROOT", "WINDIR", "USERPROFILE", "APPDATA", "LOCALAPPDATA",
+             "HOME", "DISPLAY", "WINEPREFIX")
+_MINIMAL_ENV = {k: os.environ[k] for k in _ENV_KEYS if k in os.environ}
+_MINIMAL_ENV["TEMP"] = _MINIMAL_ENV["TMP"] = str(TMPDIR)
+
+# Biblioteca de modelos lida uma vez na importação (fica no cache do SO) e
+# copiada para TMPDIR: o .include de todas as simulações aponta para a
+# cópia, e nenhuma rodada do LTspice toca a pasta do OneDrive. Os bytes
+# voltam junto para entrar no hash do cache.
+def stage_lib(lib_path):
+    lib = Path(lib_path)
+    if not lib.exists():
+        return str(lib), b""
+    data = lib.read_bytes()
+    staged = TMPDIR / lib.name
+    try:
+        if staged.read_bytes() == data:
+            return str(staged), data
+    except OSError:
+        pass
+    TMPDIR.mkdir(parents=True, exist_ok=True)
+    # Escrita atômica: com spawn, cada processo do pool reimporta o módulo
+    tmp = staged.with_name(f"{staged.name}.{os.getpid()}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, staged)
+    return str(staged), data
+
+STAGED_LIB, LIB_BYTES = stage_lib(LIB_PATH)
+
 # =========================
 # Espaço de busca (ADAPTADO para Wn, Wp, Vbias)
 # =========================
@@ -52,38 +131,38 @@ toolbox.register("population", tools.initRepeat, list, toolbox.individual)
 # Netlist template (ADAPTADO para o circuito .asc)
 # =========================
 NETLIST_TMPL = r"""
-* GA CMOS Amp Classe AB | Wn={Wn} Wp={Wp} Vbias={Vbias}
-.param Wn={Wn} Wp={Wp} Vbias={Vbias}
+* GA CMOS Amp Classe AB
+{PARAMS}
 
 .options numdgt=6
 .options reltol=1e-3 abstol=1e-9 chgtol=1e-14 vabstol=1e-6 iatol=1e-12
-.options gmin=1e-12 itl1=500 itl4=200 method=trap
+{SIM_OPTIONS}
 
 .include "{LIB_PATH}"
 
 * Componentes (Baseado no .asc)
 * L=0.6u fixo
 * Modelos alterados para NMOS e PMOS (maiúsculas)
-M8   out bias 0 0     NMOS l=0.6u w={Wn}
-M6   out in   Vdd Vdd PMOS l=0.6u w={Wp}
-M3   in  in   Vdd Vdd PMOS l=0.6u w={Wp}
-M2   in  bias 0 0     NMOS l=0.6u w={Wn}
+M8   out bias 0 0     NMOS l=0.6u w={{Wn}}
+M6   out in   Vdd Vdd PMOS l=0.6u w={{Wp}}
+M3   in  in   Vdd Vdd PMOS l=0.6u w={{Wp}}
+M2   in  bias 0 0     NMOS l=0.6u w={{Wn}}
 
 * Fontes (Baseado no .asc)
-V4    bias 0      DC {Vbias}
+V4    bias 0      DC {{Vbias}}
 Vdd   Vdd  0      DC 5
 V2    in   0      AC 1
 Vdd1  out  0      DC 0
 
-* Pontos iniciais (ajudam DC)
-.ic V(out)=2.5 V(in)=0 V(bias)={Vbias} V(vdd)=5
+* Só os vetores usados pelas medições vão para o .raw
+.save V(out) V(in) I(Vdd)
 
 * Primeiro garante .op; só depois roda .ac
 .op
 .meas op Idd FIND I(Vdd)
 
 * AC e métricas (Range do .asc)
-.ac dec 100 1e8 1e9
+.ac dec {AC_PTS} 1e8 1e9
 
 * Ganho "melhor caso" dentro da varredura
 .meas ac GAIN_DB  MAX  db(v(out)/v(in))
@@ -95,16 +174,41 @@ Vdd1  out  0      DC 0
 .end
 """.lstrip("\n")
 
+# Um estágio de 4 MOSFETs converge o .op em poucas dezenas de iterações;
+# limites menores encurtam as simulações que não vão convergir de qualquer
+# jeito. Só quando o .op falha é que se repete com os limites antigos.
+SIM_OPTIONS = ".options gmin=1e-10 itl1=100 itl4=40"
+SIM_OPTIONS_RETRY = ".options gmin=1e-12 itl1=500 itl4=200"
+
+# O netlist só varia nos .param/.step e nos pontos do .ac: a parte
+# constante é formatada uma vez e cada simulação só junta os pedaços
+def _split_netlist(sim_options):
+    txt = NETLIST_TMPL.format(PARAMS="\0", AC_PTS="\0", SIM_OPTIONS=sim_options, LIB_PATH=STAGED_LIB)
+    return tuple(txt.split("\0"))
+
+_NETLIST_PARTS = {opts: _split_netlist(opts) for opts in (SIM_OPTIONS, SIM_OPTIONS_RETRY)}
+
+def build_netlist(params, ac_pts, sim_options=SIM_OPTIONS):
+    head, mid, tail = _NETLIST_PARTS[sim_options]
+    return "".join((head, params, mid, str(ac_pts), tail))
+
 # =========================
 # Helpers de simulação
 # =========================
-# Regex da versão anterior (que estava falhando)
-MEAS_RE = {
-    "GAIN_DB": re.compile(r'gain_db:\s*MAX\(db\(v\(out\)/v\(in\)\)\)=\(([-+0-9.eE]+)', re.I),
-    "GAIN_LIN": re.compile(r'gain_lin:\s*MAX\(mag\(v\(out\)/v\(in\)\)\)=\(([-+0-9.eE]+)', re.I),
-    "FC": re.compile(r'fc\s*=\s*([-+0-9.eE]+)', re.I),
-    "IDD": re.compile(r'Idd\s*=\s*([-\d.eE]+)', re.I), 
-}
+# Uma única regex, ancorada no início da linha, para as três medições:
+# uma passada só pelo texto e sem backtracking em linhas que não começam
+# com o nome de uma medição. Formato das linhas no .log:
+#   gain_db: MAX(db(v(out)/v(in)))=(23.1dB,0°) FROM 1e+08 TO 1e+09
+#   fc: freq=1.23e+08 AT 1.23e+08
+#   idd: I(vdd)=-0.00249
+# Um único formato de valor para as medições, no log simples e nas
+# tabelas do .step: número ou ±inf, opcionalmente como complexo "(23.1dB,0°)"
+MEAS_VALUE = r'\(?(?P<{}>[-+]?inf|[-+0-9.eE]+)'
+MEAS_ALL = re.compile(
+    r'^(?:gain_db:[^=\n]*=\s*' + MEAS_VALUE.format("gain_db") +
+    r'|fc:[^=\n]*=\s*' + MEAS_VALUE.format("fc") +
+    r'|idd:[^=\n]*=\s*' + MEAS_VALUE.format("idd") + r')',
+    re.I | re.M)
 
 FATAL_MARKERS = (
     "Fatal Error", "Failed to find DC operating point",
@@ -113,128 +217,643 @@ FATAL_MARKERS = (
     "Unknown model",
     "Can't open"
 )
+# Falhas do ambiente (biblioteca/modelo inacessível), não do indivíduo:
+# como as de execução (NOT_FOUND, TIMEOUT, RC=...), não vão para o cache
+ENV_FAIL_MARKERS = ("Unknown model", "Can't open")
+# Falhas de .op que justificam uma nova tentativa com SIM_OPTIONS_RETRY
+DC_FAIL_MARKERS = (
+    "Failed to find DC operating point",
+    "Gmin stepping failed", "Could not converge to DC",
+)
+# Versão minúscula calculada uma vez, na importação
+FATAL_MARKERS_LOWER = tuple(m.lower() for m in FATAL_MARKERS)
+
+# Busca de todos os marcadores numa única passada pelo log: autômato
+# Aho-Corasick se o pyahocorasick estiver instalado; senão, uma regex com
+# as alternativas (também uma passada só)
+if ahocorasick is not None:
+    _FATAL_AUTOMATON = ahocorasick.Automaton()
+    for _m, _m_lower in zip(FATAL_MARKERS, FATAL_MARKERS_LOWER):
+        _FATAL_AUTOMATON.add_word(_m_lower, _m)
+    _FATAL_AUTOMATON.make_automaton()
+else:
+    _FATAL_RE = re.compile("|".join(re.escape(m) for m in FATAL_MARKERS_LOWER))
+
+def find_fatal(txt_lower):
+    if ahocorasick is not None:
+        for _, marker in _FATAL_AUTOMATON.iter(txt_lower):
+            return marker
+        return None
+    m = _FATAL_RE.search(txt_lower)
+    return FATAL_MARKERS[FATAL_MARKERS_LOWER.index(m.group())] if m else None
+
+# Com .step, cada medição vira uma tabela no fim do log:
+#   Measurement: gain_db
+#     step	MAX(db(v(out)/v(in)))	FROM	TO
+#        1	(30.5055dB,180°)	1e+08	1e+09
+MEAS_BLOCK_RE = re.compile(
+    r'^Measurement:[ \t]*(?P<key>gain_db|fc|idd)[ \t]*\n'  # cabeçalho
+    r'[ \t]+step\b.*\n'                                     # nomes das colunas
+    r'(?P<rows>(?:[ \t]+\d+[ \t].*(?:\n|$))*)',              # uma linha por passo
+    re.I | re.M)
+STEP_ROW_RE = re.compile(r'^[ \t]+(?P<step>\d+)[ \t]+' + MEAS_VALUE.format("val"), re.I | re.M)
+
+# Os resultados do .meas ficam no fim do log: lê de trás para frente, em
+# blocos, até encontrar as três medições (como um `tail`)
+LOG_TAIL_CHUNK = 8192
+LOG_TAIL_KEYS = (b"gain_db:", b"fc:", b"idd:")
+LOG_TAIL_KEYS_STEP = (b"measurement: gain_db", b"measurement: fc", b"measurement: idd")
+
+def read_log_tail(log_path: Path, keys=LOG_TAIL_KEYS, chunk=LOG_TAIL_CHUNK):
+    # Se alguma chave faltar, devolve o log inteiro, para que a busca por
+    # FATAL_MARKERS veja o arquivo todo
+    with open(log_path, "rb") as f:
+        pos = f.seek(0, os.SEEK_END)
+        data = b""
+        while pos > 0:
+            n = min(chunk, pos)
+            pos -= n
+            f.seek(pos)
+            data = f.read(n) + data
+            data_lower = data.lower()
+            if all(k in data_lower for k in keys):
+                break
+    return data.decode("utf-8", errors="ignore")
+
+# Estado de cada processo do pool (preenchido por _init_worker).
+# O LTspice não tem modo servidor/pipe de comandos, então o que dá para
+# reaproveitar entre avaliações é o processo Python e um diretório próprio
+# em TMPDIR; a biblioteca de modelos é a cópia única STAGED_LIB.
+# Cada processo roda uma simulação por vez, então o diretório é reusado
+# com nomes fixos: os arquivos são sobrescritos, sem criar/apagar pastas.
+_WORKER_DIR = None
+
+# Afinidade de CPU: cada worker fica num conjunto disjunto de núcleos, e o
+# LTspice que ele lança herda a afinidade. Sem isso, W LTspice
+# multi-thread disputam todos os núcleos e perdem tempo em trocas de
+# contexto.
+PIN_CPUS = os.environ.get("GA_PIN_CPUS", "1") not in ("", "0")
+
+def _available_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    if psutil is not None:
+        return sorted(psutil.Process().cpu_affinity())
+    return []
+
+def _pin_worker(idx):
+    cpus = _available_cpus()
+    if not cpus:
+        return
+    per = max(1, len(cpus) // N_WORKERS)
+    start = (idx * per) % len(cpus)
+    mine = cpus[start:start + per]
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, mine)
+    else:
+        psutil.Process().cpu_affinity(mine)
+
+def _init_worker(counter=None):
+    global _WORKER_DIR
+    _WORKER_DIR = TMPDIR / f"ga_worker_{os.getpid()}"
+    _WORKER_DIR.mkdir(parents=True, exist_ok=True)
+    if counter is not None and PIN_CPUS:
+        # Índice sequencial do worker (um substituto pega o próximo)
+        with counter.get_lock():
+            idx = counter.value
+            counter.value += 1
+        _pin_worker(idx)
+    return _WORKER_DIR
+
+def run_ltspice(netlist_text: str, timeout=TIMEOUT_S):
+    work = _WORKER_DIR or _init_worker()
 
-def run_ltspice(netlist_text: str, tag: str):
-    work = Path(tempfile.mkdtemp(prefix="ga_amp_"))
-    
     # Correção: Alterado de .asc para .cir
-    cir = work / f"{tag}.cir"
-    log = work / f"{tag}.log"
-    raw = work / f"{tag}.raw"
+    cir = work / "sim.cir"
+    log = work / "sim.log"
+    raw = work / "sim.raw"
 
     cir.write_text(netlist_text, encoding="utf-8")
+    # Trunca (em vez de apagar) o log da rodada anterior; o .raw nunca é
+    # lido e o LTspice o sobrescreve
+    open(log, "wb").close()
 
+    # stdout/stderr nunca eram usados: vão para DEVNULL em vez de pipes
+    # Sem cwd/preexec_fn/start_new_session e com close_fds=False, para não
+    # sair do caminho do posix_spawn
     cmd = [LTSPICE_EXE, *LTSPICE_ARGS, str(cir)]
     try:
-        proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                              timeout=TIMEOUT_S, check=False)
-    except subprocess.TimeoutExpired:
-        return work, cir, log, raw, "TIMEOUT", "", ""
+        proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL, env=_MINIMAL_ENV, close_fds=False)
     except FileNotFoundError:
-        return work, cir, log, raw, "NOT_FOUND", "", ""
+        return work, cir, log, raw, "NOT_FOUND"
+    try:
+        returncode = proc.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+        return work, cir, log, raw, "TIMEOUT"
 
-    stdout, stderr = proc.stdout.decode("utf-8", errors="ignore"), proc.stderr.decode("utf-8", errors="ignore")
-    status = "OK" if log.exists() else f"RC={proc.returncode}"
-    return work, cir, log, raw, status, stdout, stderr
+    # Um único stat decide: log ausente ou vazio é falha de execução
+    try:
+        status = "OK" if log.stat().st_size > 0 else f"RC={returncode}"
+    except FileNotFoundError:
+        status = f"RC={returncode}"
+    return work, cir, log, raw, status
 
 def parse_log(log_path: Path):
-    if not log_path.exists():
+    try:
+        txt = read_log_tail(log_path)
+    except OSError:
         return dict(ok=False, reason="Log file not created")
-        
-    txt = log_path.read_text(errors="ignore")
-    for m in FATAL_MARKERS:
-        if m.lower() in txt.lower():
-            # Retorna o motivo da falha
-            return dict(ok=False, reason=m) 
-
+    txt_lower = txt.lower()
+    fatal = find_fatal(txt_lower)
+    if fatal is not None:
+        # Retorna o motivo da falha
+        return dict(ok=False, reason=fatal)
+
+    # Vale a primeira ocorrência de cada medição. Medição que falha sai no
+    # log como 'Measurement "gain_db" FAIL'ed', sem valor: a chave fica
+    # ausente e fitness_eval já penaliza o ganho não medido
     vals = {}
-    m_gain = MEAS_RE["GAIN_DB"].search(txt)
-    if m_gain:
-        vals["gain_db"] = float(m_gain.group(1))
-    
-    m_fc = MEAS_RE["FC"].search(txt)
-    if m_fc:
-        try:
-            vals["fc"] = float(m_fc.group(1))
-        except:
-            pass
-            
-    m_idd = MEAS_RE["IDD"].search(txt)
-    if m_idd:
-        vals["idd"] = float(m_idd.group(1))
-
-    # Checa se medições essenciais falharam (LTspice escreve 'FAILED')
-    if "gain_db: FAILED" in txt.lower():
-        return dict(ok=False, reason="GAIN_DB measurement FAILED")
+    for m in MEAS_ALL.finditer(txt_lower):
+        key = m.lastgroup
+        if key not in vals:
+            try:
+                vals[key] = float(m.group(key))
+            except ValueError:
+                pass
 
     return dict(ok=True, **vals)
 
-def fitness_eval(ind):
+def parse_step_log(log_path: Path, n_steps):
+    # Falha do ambiente (biblioteca/modelo inacessível) vale para o lote
+    # inteiro: devolve None. Passos sem linha na tabela (falha de
+    # .op/medição) ficam NaN
+    txt = read_log_tail(log_path, LOG_TAIL_KEYS_STEP)
+    if find_fatal(txt.lower()) in ENV_FAIL_MARKERS:
+        return None
+    vals = {key: [math.nan] * n_steps for key in ("gain_db", "fc", "idd")}
+    for block in MEAS_BLOCK_RE.finditer(txt):
+        col = vals[block.group("key").lower()]
+        for m in STEP_ROW_RE.finditer(block.group("rows")):
+            step = int(m.group("step"))
+            if 1 <= step <= n_steps:
+                col[step - 1] = float(m.group("val"))
+    return vals
+
+# Estimativa de potência para descartar, sem chamar o LTspice, quem
+# obviamente não serve. Com in e out presos em 0 V DC (V2 e Vdd1), M2/M8
+# não conduzem e a corrente de Vdd é a de M3 + M6 com Vgs = -VDD,
+# proporcional a Wp (simulacoes/*.log: Id(m3) = Id(m6) = -2.49 mA com
+# Wp = 10u, em todo Vbias): ~24.9 mW a cada 10 um de Wp.
+VDD = 5.0
+ID_PMOS_PER_W = 2.49e-3 / 10e-6  # A/m
+MAX_POWER_EST = 100e-3  # W
+
+def reject_mask(genes):
+    # Para a matriz (N, 3) inteira, no processo principal (evaluate_all):
+    # os descartados nem chegam ao pool
+    genes = np.asarray(genes, dtype=np.float64)
+    return VDD * 2 * ID_PMOS_PER_W * genes[:, 1] > MAX_POWER_EST
+
+# Rótulo do indivíduo, só formatado quando há falha a reportar
+def ind_tag(Wn, Wp, V):
+    return f"Wn{Wn:.3e}_Wp{Wp:.3e}_V{V:.3f}".replace("+", "").replace("-", "m")
+
+def fitness_eval(ind, ac_pts=AC_PTS_FINE):
     Wn, Wp, V = ind
     if not (WN_MIN <= Wn <= WN_MAX and WP_MIN <= Wp <= WP_MAX and V_MIN <= V <= V_MAX):
         return (-360.0, 0.0, 1e3)
+    # O motor tem de ser o mesmo que entra no hash do cache
+    if USE_NGSPICE:
+        return ngspice_eval(ind, ac_pts)
+
+    params = f".param Wn={Wn} Wp={Wp} Vbias={V}"
+    for sim_options in (SIM_OPTIONS, SIM_OPTIONS_RETRY):
+        net = build_netlist(params, ac_pts, sim_options)
+        work, cir, log, raw, status = run_ltspice(net)
+        parsed = parse_log(log) if status == "OK" else dict(ok=False, reason=status)
+        if parsed.get("reason") not in DC_FAIL_MARKERS:
+            break
+
+    # status "OK" já garante um log não vazio (run_ltspice). Falha de
+    # execução/ambiente devolve None: é transitória, não um resultado
+    if status != "OK":
+        # <-- MODO DE DEPURAÇÃO: Imprime falha de execução
+        print(f"!!! FALHA DE EXECUÇÃO: Status={status}, Individuo={ind_tag(Wn, Wp, V)}")
+        return None
+
+    if parsed.get("reason") in ENV_FAIL_MARKERS:
+        print(f"!!! FALHA DE AMBIENTE (do .log): {parsed['reason']} em {ind_tag(Wn, Wp, V)}")
+        return None
+
+    if not parsed.get("ok", False):
+        # <-- MODO DE DEPURAÇÃO: Imprime falha de simulação (ex: convergência DC)
+        print(f"!!! FALHA DE SIMULAÇÃO (do .log): {parsed.get('reason')} em {ind_tag(Wn, Wp, V)}")
+        return (-360.0, 0.0, 1e3)
 
-    tag = f"Wn{Wn:.3e}_Wp{Wp:.3e}_V{V:.3f}".replace("+", "").replace("-", "m")
-    net = NETLIST_TMPL.format(Wn=Wn, Wp=Wp, Vbias=V, LIB_PATH=LIB_PATH)
+    # Processa os valores
+    gain_db = float(parsed.get("gain_db", -360.0))
+    ugbw = float(parsed.get("fc", 0.0)) # Default é 0.0, não é uma falha
+    idd = abs(float(parsed.get("idd", 1e9))) # Default é alta potência
+    
+    if idd > 1e3:
+         power = 1e3
+    else:
+         power = 5.0 * idd
+
+    # Protege contra NaN
+    if not math.isfinite(gain_db): gain_db = -360.0
+    if not math.isfinite(ugbw): ugbw = 0.0
+    if not math.isfinite(power): power = 1e3
+    
+    # Só consideramos falha se o GANHO não for medido.
+    if gain_db == -360.0:
+        # <-- MODO DE DEPURAÇÃO: Imprime falha de medição
+        print(f"!!! FALHA DE MEDIÇÃO: gain_db não foi encontrado no log de {ind_tag(Wn, Wp, V)}")
+        return (-360.0, 0.0, 1e3)
 
-    work, cir, log, raw, status, so, se = run_ltspice(net, tag)
+    # Se chegou aqui, a simulação é válida
+    return (gain_db, ugbw, power)
 
-    try:
-        if status != "OK" or not log.exists():
-            # <-- MODO DE DEPURAÇÃO: Imprime falha de execução
-            print(f"!!! FALHA DE EXECUÇÃO: Status={status}, Log Existe={log.exists()}, Arquivo={log.parent.name}")
-            return (-360.0, 0.0, 1e3)
-
-        parsed = parse_log(log)
-        if not parsed.get("ok", False):
-            # <-- MODO DE DEPURAÇÃO: Imprime falha de simulação (ex: convergência DC)
-            print(f"!!! FALHA DE SIMULAÇÃO (do .log): {parsed.get('reason')} em {log.parent.name}")
-            return (-360.0, 0.0, 1e3)
-
-        # Processa os valores
-        gain_db = float(parsed.get("gain_db", -360.0))
-        ugbw = float(parsed.get("fc", 0.0)) # Default é 0.0, não é uma falha
-        idd = abs(float(parsed.get("idd", 1e9))) # Default é alta potência
-        
-        if idd > 1e3:
-             power = 1e3
-        else:
-             power = 5.0 * idd
-
-        # Protege contra NaN
-        if not math.isfinite(gain_db): gain_db = -360.0
-        if not math.isfinite(ugbw): ugbw = 0.0
-        if not math.isfinite(power): power = 1e3
-        
-        # Só consideramos falha se o GANHO não for medido.
-        if gain_db == -360.0:
-            # <-- MODO DE DEPURAÇÃO: Imprime falha de medição
-            print(f"!!! FALHA DE MEDIÇÃO: gain_db não foi encontrado no log {log.parent.name}")
-            return (-360.0, 0.0, 1e3)
-
-        # Se chegou aqui, a simulação é válida
-        return (gain_db, ugbw, power)
+# =========================
+# ngspice em biblioteca compartilhada (opcional, USE_NGSPICE=1)
+# =========================
+# Em vez de um processo do LTspice por simulação, cada worker mantém uma
+# instância do libngspice com o circuito carregado uma vez; por avaliação
+# só as larguras e o Vbias mudam (alter) e as análises rodam de novo, sem
+# fork/exec nem arquivos.
+USE_NGSPICE = os.environ.get("USE_NGSPICE", "0") not in ("", "0")
+if USE_NGSPICE:
+    from PySpice.Spice.NgSpice.Shared import NgSpiceShared
+
+# Mesmo circuito do NETLIST_TMPL; as análises vão como comandos de controle
+NGSPICE_CIRCUIT = r"""
+* GA CMOS Amp Classe AB (ngspice)
+.options reltol=1e-3 abstol=1e-9 chgtol=1e-14 vntol=1e-6
+{SIM_OPTIONS}
+.include "{LIB_PATH}"
+M8   out bias 0 0     NMOS l=0.6u w=5u
+M6   out in   Vdd Vdd PMOS l=0.6u w=10u
+M3   in  in   Vdd Vdd PMOS l=0.6u w=10u
+M2   in  bias 0 0     NMOS l=0.6u w=5u
+V4    bias 0      DC 1.5
+Vdd   Vdd  0      DC 5
+V2    in   0      AC 1
+Vdd1  out  0      DC 0
+.end
+""".lstrip("\n")
 
-    finally:
+# Limites de iteração do .op como comando de controle (os mesmos do LTspice)
+NG_OPTIONS = "option " + SIM_OPTIONS.split(None, 1)[1]
+NG_OPTIONS_RETRY = "option " + SIM_OPTIONS_RETRY.split(None, 1)[1]
+
+# Saída de 'print' e 'meas': "vdd#branch = -1.2e-03", "gain_db = 2.31e+01 at= ..."
+NG_VALUE_RE = re.compile(r'^\s*([\w#]+)\s*=\s*([-+0-9.eE]+)', re.M)
+
+class NgspiceWorker:
+    def __init__(self, lib_path):
+        self.ng = NgSpiceShared.new_instance()
+        self.ng.load_circuit(NGSPICE_CIRCUIT.format(SIM_OPTIONS=SIM_OPTIONS, LIB_PATH=lib_path))
+
+    def evaluate(self, Wn, Wp, V, ac_pts):
+        ng = self.ng
+        for cmd in (f"alter @m8[w]={Wn}", f"alter @m2[w]={Wn}",
+                    f"alter @m6[w]={Wp}", f"alter @m3[w]={Wp}", f"alter v4 dc={V}"):
+            ng.exec_command(cmd)
         try:
-            # <-- MODO DE DEPURAÇÃO: Limpeza DESATIVADA
-            # shutil.rmtree(work, ignore_errors=True)
-            pass
-        except: pass
+            out = self._simulate(ac_pts)
+        except Exception:
+            # .op não convergiu: mesma nova tentativa do caminho do LTspice,
+            # com os limites de SIM_OPTIONS_RETRY, depois volta aos normais.
+            # Se o comando ainda falha, é erro do motor: None (fora do cache)
+            try:
+                ng.exec_command(NG_OPTIONS_RETRY)
+                out = self._simulate(ac_pts)
+            except Exception:
+                return None
+            finally:
+                ng.exec_command(NG_OPTIONS)
+        vals = {k.lower(): float(v) for k, v in NG_VALUE_RE.findall("\n".join(out))}
+        fit = to_fitness(vals.get("gain_db", math.nan), vals.get("fc", math.nan),
+                         abs(vals.get("vdd#branch", math.nan)))
+        # Simulação rodou e o ganho não foi medido: resultado determinístico
+        return fit if fit is not None else (-360.0, 0.0, 1e3)
+
+    def _simulate(self, ac_pts):
+        ng = self.ng
+        out = []
+        try:
+            ng.exec_command("op")
+            out.append(ng.exec_command("print vdd#branch"))
+            ng.exec_command(f"ac dec {ac_pts} 1e8 1e9")
+            ng.exec_command("let h = vm(out)/vm(in)")
+            ng.exec_command("let hdb = db(h)")
+            # Cada medição pode falhar sozinha (ex.: |H| nunca cruza 1)
+            for cmd in ("meas ac gain_db max hdb", "meas ac fc when h=1 cross=1"):
+                try:
+                    out.append(ng.exec_command(cmd))
+                except Exception:
+                    pass
+        finally:
+            ng.exec_command("destroy all")
+        return out
+
+_NGSPICE = None
+
+def ngspice_eval(ind, ac_pts):
+    global _NGSPICE
+    if _NGSPICE is None:
+        # libngspice/biblioteca inacessível: falha transitória, tenta de novo
+        # na próxima avaliação
+        try:
+            _NGSPICE = NgspiceWorker(STAGED_LIB)
+        except Exception as e:
+            print(f"!!! FALHA DE AMBIENTE (ngspice): {e}")
+            return None
+    return _NGSPICE.evaluate(*ind, ac_pts)
 
-toolbox.register("evaluate", fitness_eval)
-toolbox.register("mate", tools.cxBlend, alpha=0.3)
-toolbox.register("mutate", tools.mutGaussian, mu=0, sigma=0.15, indpb=0.5)
-toolbox.register("select", tools.selNSGA2)
+# =========================
+# Avaliação em lote (.step)
+# =========================
+# Uma única chamada do LTspice por lote: os genes entram como tabelas
+# indexadas por idx e o .step percorre os indivíduos, amortizando a
+# partida do simulador e a leitura dos modelos.
+def step_params(inds):
+    lines = [".step param idx list " + " ".join(str(i) for i in range(len(inds)))]
+    for j, name in enumerate(("Wn", "Wp", "Vbias")):
+        pairs = ", ".join(f"{i}, {ind[j]:.9g}" for i, ind in enumerate(inds))
+        lines.append(f".param {name}=table(idx, {pairs})")
+    return "\n".join(lines)
+
+def to_fitness(gain_db, ugbw, idd):
+    # NaN = ganho não medido (sem linha na tabela): não há resultado.
+    # -inf é medição real (|H| = 0, ex.: out preso em 0 V por Vdd1) e vira
+    # a penalidade, como em fitness_eval (±inf)
+    if math.isnan(gain_db):
+        return None
+    if not math.isfinite(gain_db):
+        return (-360.0, 0.0, 1e3)
+    power = 5.0 * idd if idd <= 1e3 else 1e3
+    if not math.isfinite(ugbw): ugbw = 0.0
+    if not math.isfinite(power): power = 1e3
+    return (gain_db, ugbw, power)
+
+def fitness_eval_batch(inds, ac_pts=AC_PTS_FINE):
+    fits = [None] * len(inds)
+    if USE_NGSPICE:
+        return [ngspice_eval(ind, ac_pts) for ind in inds]
+
+    if len(inds) > 1:
+        net = build_netlist(step_params(inds), ac_pts)
+        # TIMEOUT_S vale por simulação: o lote tem len(inds) delas em série
+        work, cir, log, raw, status = run_ltspice(net, TIMEOUT_S * len(inds))
+        if status == "OK":
+            vals = parse_step_log(log, len(inds))
+            if vals is None:
+                # Refazer um a um daria no mesmo erro: o lote todo fica
+                # como falha transitória (None, fora do cache)
+                return fits
+            for i in range(len(inds)):
+                fits[i] = to_fitness(vals["gain_db"][i], vals["fc"][i], abs(vals["idd"][i]))
+
+    # O que o lote não resolveu (falha de .op, medição ausente, lote de um
+    # só) é refeito individualmente, com a nova tentativa de SIM_OPTIONS_RETRY
+    return [fit if fit is not None else fitness_eval(ind, ac_pts)
+            for fit, ind in zip(fits, inds)]
+
+# =========================
+# Cache de fitness
+# =========================
+# Cruzamento/mutação revisitam indivíduos quase idênticos; a chave é o
+# genoma arredondado (1 nm em W, 1 mV em Vbias), bem abaixo da resolução
+# que altera o resultado da simulação. O cache fica no processo principal
+# (os workers não compartilham memória), num dict para as consultas, e cada
+# resultado novo também vai para um SQLite por versão do netlist: uma nova
+# execução (ou a retomada após uma queda) reaproveita as simulações.
+CACHE_DIR = Path(os.environ.get("GA_CACHE_DIR", "ga_runs"))
+# (o motor também entra no hash: LTspice e ngspice não dão os mesmos números;
+# e a biblioteca de modelos, que muda os resultados sem mudar o netlist)
+_SIM_SOURCE = (NGSPICE_CIRCUIT if USE_NGSPICE else NETLIST_TMPL) + SIM_OPTIONS + SIM_OPTIONS_RETRY
+NETLIST_HASH = hashlib.sha1(_SIM_SOURCE.encode("utf-8") + LIB_BYTES).hexdigest()[:12]
+CACHE_PATH = CACHE_DIR / f"fitness_cache_{NETLIST_HASH}.sqlite"
+
+_FIT_CACHE = {}
+_CACHE_DB = None
+_CACHE_STATS = {"hits": 0, "misses": 0}
+
+def cache_key(ind, ac_pts):
+    return (round(ind[0], 9), round(ind[1], 9), round(ind[2], 3), ac_pts)
+
+def load_cache():
+    global _CACHE_DB
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    _CACHE_DB = sqlite3.connect(CACHE_PATH)
+    _CACHE_DB.execute("PRAGMA journal_mode=WAL")
+    _CACHE_DB.execute(
+        "CREATE TABLE IF NOT EXISTS fitness (wn REAL, wp REAL, vbias REAL, ac_pts INTEGER,"
+        " gain_db REAL, ugbw REAL, power REAL, PRIMARY KEY (wn, wp, vbias, ac_pts))")
+    for Wn, Wp, V, ac_pts, gain_db, ugbw, power in _CACHE_DB.execute("SELECT * FROM fitness"):
+        _FIT_CACHE[(Wn, Wp, V, ac_pts)] = (gain_db, ugbw, power)
+
+def store_cache(new):
+    # Uma transação por chamada de evaluate_all
+    _FIT_CACHE.update(new)
+    if _CACHE_DB is not None and new:
+        with _CACHE_DB:
+            _CACHE_DB.executemany("INSERT OR REPLACE INTO fitness VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                  [(*k, *fit) for k, fit in new.items()])
+
+def close_cache():
+    global _CACHE_DB
+    if _CACHE_DB is not None:
+        _CACHE_DB.close()
+        _CACHE_DB = None
+
+def evaluate_all(inds, ac_pts):
+    # Só os genomas ainda não vistos vão para o pool de simulação, em lotes
+    # .step de até BATCH_MAX (pelo menos um lote por worker)
+    # (genomas repetidos dentro da própria chamada são simulados uma vez só)
+    keys = [cache_key(ind, ac_pts) for ind in inds]
+    todo = list({k: ind for ind, k in zip(inds, keys) if k not in _FIT_CACHE}.values())
+    _CACHE_STATS["hits"] += len(inds) - len(todo)
+    new = {}
+    if todo:
+        rejected = reject_mask(todo)
+        for ind in (ind for ind, r in zip(todo, rejected) if r):
+            new[cache_key(ind, ac_pts)] = (-360.0, 0.0, 1e3)
+        todo = [ind for ind, r in zip(todo, rejected) if not r]
+    _CACHE_STATS["misses"] += len(todo)
+    n_batches = max(min(len(todo), N_WORKERS), -(-len(todo) // BATCH_MAX))
+    batches = [todo[i::n_batches] for i in range(n_batches)]
+    evaluate = partial(toolbox.evaluate_batch, ac_pts=ac_pts)
+    # None = falha transitória (LTspice ausente, timeout, biblioteca
+    # inacessível): penaliza nesta geração, mas não entra no cache
+    failed = {}
+    for batch, fits in zip(batches, toolbox.map(evaluate, batches)):
+        for ind, fit in zip(batch, fits):
+            if fit is None:
+                failed[cache_key(ind, ac_pts)] = (-360.0, 0.0, 1e3)
+            else:
+                new[cache_key(ind, ac_pts)] = tuple(fit)
+    store_cache(new)
+    if failed:
+        print(f"!!! {len(failed)} avaliações com falha transitória (não salvas no cache)")
+    return [_FIT_CACHE[k] if k in _FIT_CACHE else failed[k] for k in keys]
 
-def clip_params(ind):
-    ind[0] = float(np.clip(ind[0], WN_MIN, WN_MAX)) # Wn
-    ind[1] = float(np.clip(ind[1], WP_MIN, WP_MAX)) # Wp
-    ind[2] = float(np.clip(ind[2], V_MIN, V_MAX))  # Vbias
+# =========================
+# Operadores genéticos vetorizados (NumPy)
+# =========================
+# Equivalentes a tools.cxBlend / tools.mutGaussian / tools.selNSGA2 /
+# tools.selTournamentDCD, mas operando de uma vez sobre as matrizes (N, 3)
+# de genes e de fitness, em vez de uma chamada Python por indivíduo.
+BOUNDS_LO = np.array([WN_MIN, WP_MIN, V_MIN])
+BOUNDS_HI = np.array([WN_MAX, WP_MAX, V_MAX])
+# O sigma da mutação é uma fração da faixa de cada gene: W (metros) e
+# Vbias (volts) têm escalas muito diferentes
+GENE_SCALES = BOUNDS_HI - BOUNDS_LO
+CX_ALPHA = 0.3
+MUT_SIGMA = 0.15
+MUT_INDPB = 0.5
+# Pesos dos objetivos (+ganho, +UGBW, -potência): F = fits * WEIGHTS é
+# "maior é melhor" em todas as colunas
+WEIGHTS = np.array(creator.FitnessMulti.weights)
+
+def clip_params(genes):
+    np.clip(genes, BOUNDS_LO, BOUNDS_HI, out=genes)
+
+def vary(genes, cxpb, mutpb, rng):
+    # Cruzamento blend entre pares consecutivos (0,1), (2,3), ...
+    changed = np.zeros(len(genes), dtype=bool)
+    n = len(genes) - len(genes) % 2
+    pairs = np.flatnonzero(rng.random(n // 2) < cxpb) * 2
+    if len(pairs):
+        p1, p2 = genes[pairs], genes[pairs + 1]
+        gamma = (1.0 + 2.0 * CX_ALPHA) * rng.random(p1.shape) - CX_ALPHA
+        genes[pairs] = (1.0 - gamma) * p1 + gamma * p2
+        genes[pairs + 1] = gamma * p1 + (1.0 - gamma) * p2
+        changed[pairs] = changed[pairs + 1] = True
+
+    # Mutação gaussiana: indivíduo com prob. mutpb, cada gene com MUT_INDPB
+    mutants = rng.random(len(genes)) < mutpb
+    mask = mutants[:, None] & (rng.random(genes.shape) < MUT_INDPB)
+    genes += mask * rng.normal(0.0, MUT_SIGMA * GENE_SCALES, genes.shape)
+    changed |= mutants
+
+    clip_params(genes)
+    return changed
+
+# Com população pequena, cruzamento + mutação geram muitos filhos
+# repetidos; abaixo desta fração de genomas distintos, as cópias dão lugar
+# a indivíduos aleatórios novos
+MIN_UNIQUE_FRAC = 0.6
+
+def duplicate_rows(genes):
+    # Mesmo arredondamento do cache_key; marca toda repetição após a 1ª
+    q = np.column_stack((genes[:, :2].round(9), genes[:, 2].round(3)))
+    _, first = np.unique(q, axis=0, return_index=True)
+    dup = np.ones(len(genes), dtype=bool)
+    dup[first] = False
+    return dup
+
+def dominates(Fa, Fb):
+    return (Fa >= Fb).all(-1) & (Fa > Fb).any(-1)
+
+def nondominated_ranks(F, k=None):
+    # dom[i, j] = i domina j. Com k, para assim que as frentes já somam k
+    # indivíduos: os demais ficam todos com o rank seguinte
+    dom = dominates(F[:, None], F[None])
+    n_dom = dom.sum(axis=0)
+    ranks = np.full(len(F), -1)
+    r = 0
+    while (ranks < 0).any():
+        if k is not None and (ranks >= 0).sum() >= k:
+            ranks[ranks < 0] = r
+            break
+        front = (ranks < 0) & (n_dom == 0)
+        ranks[front] = r
+        n_dom = n_dom - dom[front].sum(axis=0)
+        r += 1
+    return ranks
+
+def crowding_distance(F, ranks):
+    cd = np.zeros(len(F))
+    for r in np.unique(ranks):
+        idx = np.flatnonzero(ranks == r)
+        for m in range(F.shape[1]):
+            order = idx[np.argsort(F[idx, m], kind="stable")]
+            cd[order[[0, -1]]] = np.inf
+            span = F.shape[1] * (F[order[-1], m] - F[order[0], m])
+            if span > 0 and len(order) > 2:
+                cd[order[1:-1]] += (F[order[2:], m] - F[order[:-2], m]) / span
+    return cd
+
+def sel_nsga2(fits, k):
+    # Devolve os índices escolhidos com o rank e a crowding distance de
+    # cada um, guardados para o torneio da próxima geração
+    F = fits * WEIGHTS
+    ranks = nondominated_ranks(F, k)
+    cd = crowding_distance(F, ranks)
+    chosen = np.lexsort((-cd, ranks))[:k]
+    return chosen, ranks[chosen], cd[chosen]
+
+def sel_tournament_dcd(ranks, cd, k, rng):
+    # Torneios binários entre pares de duas permutações da população, pelo
+    # operador de comparação do NSGA-II: vence o menor rank; no mesmo rank,
+    # a maior crowding distance; empate, sorteio. Usa o rank/crowding já
+    # calculados por sel_nsga2, sem refazer as comparações de dominância
+    n = len(ranks)
+    idx = np.concatenate([rng.permutation(n) for _ in range(-(-2 * k // n))])[:2 * k]
+    a, b = idx[0::2], idx[1::2]
+    coin = rng.random(k) < 0.5
+    same = ranks[a] == ranks[b]
+    pick_a = (ranks[a] < ranks[b]) | (same & ((cd[a] > cd[b]) | ((cd[a] == cd[b]) & coin)))
+    return np.where(pick_a, a, b)
+
+def as_individuals(genes, fits):
+    # Visão "Array-of-Structs" (Individual do DEAP) montada só quando preciso
+    pop = [creator.Individual(g) for g in genes.tolist()]
+    for ind, f in zip(pop, fits.tolist()):
+        ind.fitness.values = f
+    return pop
+
+toolbox.register("evaluate", fitness_eval)
+toolbox.register("evaluate_batch", fitness_eval_batch)
 
 def main(seed=42, pop_size=20, ngen=12, cxpb=0.6, mutpb=0.4):
+    # Cada worker simula em seu próprio diretório, então as simulações
+    # de uma geração podem ser despachadas em paralelo sem colisão.
+    # Os workers vivem durante todo o GA (diretório e modelos preparados 1x)
+    load_cache()
+    try:
+        with Pool(N_WORKERS, initializer=_init_worker, initargs=(Value("i", 0),)) as pool:
+            # chunksize=1: cada lote .step (até BATCH_MAX indivíduos) é uma
+            # tarefa, e um worker livre pega o próximo lote assim que termina,
+            # em vez de ficar ocioso esperando o lote mais lento
+            toolbox.register("map", pool.map, chunksize=1)
+            return _run_ga(seed, pop_size, ngen, cxpb, mutpb)
+    finally:
+        close_cache()
+
+def ac_pts_for(gen, ngen):
+    return AC_PTS_FINE if gen > ngen - AC_FINE_GENS else AC_PTS_COARSE
+
+# Parada por estagnação: se o melhor valor escalarizado não muda em
+# STALL_GENS gerações seguidas, as restantes só gastariam simulações
+STALL_GENS = 4
+STALL_TOL = 1e-6
+
+def scalarize(fits):
+    return fits[..., 0] + 1e-6 * fits[..., 1] - 1e3 * fits[..., 2]
+
+# Linha de estatísticas por geração, montada uma vez: avg/max/min com 3
+# objetivos cada, na largura de 30 colunas do cabeçalho
+STATS_ROW = "{:<7}{:<8}" + "[{:8.3g} {:8.3g} {:8.3g}]  " * 3
+
+def _run_ga(seed, pop_size, ngen, cxpb, mutpb):
     random.seed(seed)
-    pop = toolbox.population(n=pop_size)
+    rng = np.random.default_rng(seed)
 
     anchors = [
         [5e-6, 10e-6, 1.5], 
@@ -242,62 +861,74 @@ def main(seed=42, pop_size=20, ngen=12, cxpb=0.6, mutpb=0.4):
         [3e-6, 15e-6, 2.5], # Wn=3um (agora válido)
         [8e-6, 8e-6, 3.0],
     ]
-    for a in anchors:
-        pop.append(creator.Individual(a))
-
-    for ind in pop: clip_params(ind)
 
-    fits = list(map(toolbox.evaluate, pop))
-    for ind, fit in zip(pop, fits):
-        ind.fitness.values = fit
+    # População em Struct-of-Arrays: genes (N, 3) e fitness (N, 3) em
+    # memória contígua; a seleção e a variação operam direto sobre elas
+    genes = np.array(toolbox.population(n=pop_size) + anchors, dtype=np.float64)
+    clip_params(genes)
 
-    pop = toolbox.select(pop, pop_size)
+    ac_pts = ac_pts_for(0, ngen)
+    fits = np.array(evaluate_all(genes.tolist(), ac_pts))
 
-    stats = tools.Statistics(lambda ind: ind.fitness.values)
-    stats.register("avg", np.mean, axis=0)
-    stats.register("max", np.max, axis=0)
-    stats.register("min", np.min, axis=0)
+    chosen, ranks, cd = sel_nsga2(fits, pop_size)
+    genes, fits = genes[chosen], fits[chosen]
 
     hof = tools.ParetoFront()
+    recent_best = deque(maxlen=STALL_GENS)
 
     print(f"{'gen':<7}{'nevals':<8}{'avg':<30}{'max':<30}{'min':<30}")
     for gen in range(ngen + 1):
         if gen > 0:
-            offspring = tools.selTournamentDCD(pop, len(pop))
-            offspring = [toolbox.clone(ind) for ind in offspring.copy()] # .copy() é mais seguro
-
-            for i in range(0, len(offspring), 2):
-                if random.random() < cxpb and i+1 < len(offspring):
-                    toolbox.mate(offspring[i], offspring[i+1])
-                    del offspring[i].fitness.values, offspring[i+1].fitness.values
-            for i, ind in enumerate(offspring):
-                if random.random() < mutpb:
-                    toolbox.mutate(ind)
-                    clip_params(ind)
-                    del ind.fitness.values
-
-            invalid = [ind for ind in offspring if not ind.fitness.valid]
-            fits = map(toolbox.evaluate, invalid)
-            for ind, fit in zip(invalid, fits):
-                ind.fitness.values = fit
-
-            pop = toolbox.select(pop + offspring, pop_size)
-
-        record = stats.compile(pop)
-        print(f"{'gen':<7}{len(pop):<8}{np.array2string(record['avg'], precision=3, suppress_small=True):<30}"
-              f"{np.array2string(record['max'], precision=3, suppress_small=True):<30}"
-              f"{np.array2string(record['min'], precision=3, suppress_small=True):<30}")
-        hof.update(pop)
-
-    def scalarize(f):
-        return f[0] + 1e-6 * f[1] - 1e3 * f[2]
-    best = max(pop, key=lambda ind: scalarize(ind.fitness.values))
-
-    Wn, Wp, V = best
-    gain_db, ugbw, power = best.fitness.values
+            if ac_pts_for(gen, ngen) != ac_pts:
+                # Troca para a varredura fina: reavalia a população atual
+                # para que pais e filhos sejam comparados na mesma base
+                ac_pts = ac_pts_for(gen, ngen)
+                fits = np.array(evaluate_all(genes.tolist(), ac_pts))
+                chosen, ranks, cd = sel_nsga2(fits, pop_size)
+                genes, fits = genes[chosen], fits[chosen]
+                recent_best.clear()
+
+            # Indexação por vetor já devolve cópias
+            parents = sel_tournament_dcd(ranks, cd, len(genes), rng)
+            off_genes, off_fits = genes[parents], fits[parents]
+
+            valid = ~vary(off_genes, cxpb, mutpb, rng)
+            dup = duplicate_rows(off_genes)
+            if len(off_genes) - dup.sum() < MIN_UNIQUE_FRAC * len(off_genes):
+                off_genes[dup] = toolbox.population(n=int(dup.sum()))
+                valid &= ~dup
+            if not valid.all():
+                off_fits[~valid] = evaluate_all(off_genes[~valid].tolist(), ac_pts)
+
+            all_genes = np.concatenate((genes, off_genes))
+            all_fits = np.concatenate((fits, off_fits))
+            chosen, ranks, cd = sel_nsga2(all_fits, pop_size)
+            genes, fits = all_genes[chosen], all_fits[chosen]
+
+        record = {"avg": fits.mean(axis=0), "max": fits.max(axis=0), "min": fits.min(axis=0)}
+        print(STATS_ROW.format(gen, len(genes), *record["avg"], *record["max"], *record["min"]))
+        # Só a 1ª frente pode entrar no ParetoFront: converte apenas essas
+        # linhas em Individual, em vez da população inteira
+        front = ranks == 0
+        hof.update(as_individuals(genes[front], fits[front]))
+
+        recent_best.append(scalarize(fits).max())
+        if len(recent_best) == STALL_GENS and max(recent_best) - min(recent_best) < STALL_TOL:
+            print(f"Estagnou por {STALL_GENS} gerações: parando na geração {gen}")
+            break
+
+    if ac_pts != AC_PTS_FINE:
+        # Parou antes da varredura fina: o resultado final usa a fina
+        fits = np.array(evaluate_all(genes.tolist(), AC_PTS_FINE))
+
+    best = int(scalarize(fits).argmax())
+
+    Wn, Wp, V = genes[best].tolist()
+    gain_db, ugbw, power = fits[best].tolist()
     print("\n===== RESULTADO =====")
     print(f"Melhor individuo [W_n, W_p, Vbias] = [{Wn}, {Wp}, {V}]")
     print(f"Metricas (Gain_dB, UGBW_Hz, Power_W): ({gain_db}, {ugbw}, {power})")
+    print(f"Cache de fitness: {_CACHE_STATS['hits']} acertos, {_CACHE_STATS['misses']} simulações")
 
 if __name__ == "__main__":
     kwargs = {}